@@ -4,10 +4,32 @@ from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 import os
 import sys
+import queue
+import atexit
 import logging
+import logging.handlers
+
+# Configure logging once for the whole application. Records are handed to a
+# queue and written to the console and a rotating log file by a background
+# thread, so request handlers never block on log I/O.
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+file_handler = logging.handlers.RotatingFileHandler(
+    log_dir / "sat_annotator.log", maxBytes=10 * 1024 * 1024, backupCount=5
+)
+file_handler.setFormatter(log_formatter)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(log_formatter)
+
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener.start()
+atexit.register(log_listener.stop)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Add the app directory to the path to handle imports
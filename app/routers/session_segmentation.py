@@ -1,40 +1,93 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, StreamingResponse
 from app.storage.session_manager import get_session_manager, SessionManager
 from app.storage.session_store import session_store
 from app.utils.sam_model import SAMSegmenter
 from pydantic import BaseModel
 from typing import List, Optional
+import copy
 import json
+import asyncio
 from pathlib import Path
 import os
 import logging
 from datetime import datetime
-import cv2
+from functools import lru_cache
 from app.schemas.session_schemas import ManualAnnotationCreate, ManualAnnotationUpdate, AnnotationResponse
 
-# Set up logging
-log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
-log_filename = f"debug_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-logging.basicConfig(
-    level=logging.INFO,  # Changed from DEBUG to INFO
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_dir / log_filename),
-        logging.StreamHandler()
-    ]
-)
+try:
+    import orjson
+except ImportError:  # orjson is optional - fall back to the stdlib encoder
+    orjson = None
+
+# Logging handlers are configured once by the application (see main.py)
 logger = logging.getLogger("segmentation_router")
 
 router = APIRouter()
 segmenter = SAMSegmenter()
 
+# Determine if we're running in Docker or locally
+in_docker = os.path.exists('/.dockerenv')
+
+# Project root for local development; stored upload paths are relative to it
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Resolve the annotation directory once instead of on every request
+if in_docker:
+    ANNOTATION_DIR = Path("/app/annotations")
+else:
+    ANNOTATION_DIR = Path(os.path.join(PROJECT_DIR, "annotations"))
+
+ANNOTATION_DIR.mkdir(exist_ok=True)
+
+# Client-supplied annotation IDs are embedded in file names; IDs containing
+# these are rejected (mapping them away would let distinct IDs share a file)
+UNSAFE_ID_CHARS = frozenset(':/\\\0')
+MAX_ANNOTATION_ID_LENGTH = 128
+
+# Serialize annotation responses with orjson when it is installed
+AnnotationJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+def write_json(path, data, indent=True):
+    """Write JSON data to disk, using orjson when available"""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(data, option=option))
+    else:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2 if indent else None)
+
+def dumps_json(data):
+    """Serialize data (including datetimes) to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(jsonable_encoder(data)).encode()
+
+def read_json(path):
+    """Read JSON data from disk, using orjson when available"""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r") as f:
+        return json.load(f)
+
+@lru_cache(maxsize=4096)
+def load_annotation_file(path, mtime_ns, size):
+    """
+    Parse an annotation file, caching the result per (path, mtime, size).
+    Rewriting the file changes its mtime, so stale entries are never returned.
+    
+    Legacy read path: the routes in this module always register annotations
+    with their GeoJSON in memory, so this only serves annotations added to
+    the session store without data.
+    """
+    return read_json(path)
+
 def construct_image_path(stored_path):
     """Construct consistent image path for both preprocessing and segmentation"""
-    # Determine if running in Docker
-    in_docker = os.path.exists('/.dockerenv')
-    
     if not os.path.isabs(stored_path):
         if in_docker:
             # Docker environment
@@ -45,8 +98,7 @@ def construct_image_path(stored_path):
         else:
             # Local environment
             if stored_path.startswith("uploads/"):
-                base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-                image_path = os.path.join(base_dir, stored_path)
+                image_path = os.path.join(PROJECT_DIR, stored_path)
             else:
                 image_path = stored_path
     else:
@@ -79,13 +131,13 @@ async def segment_from_point(
     session_manager: SessionManager = Depends(get_session_manager)
 ):
     """Generate segmentation from a point click with timeout handling"""
-    import asyncio
     import concurrent.futures
     
     session_id = session_manager.session_id
     
     # Debug: log the received coordinates
-    logger.debug(f"Received segmentation request: image_id={prompt.image_id}, x={prompt.x}, y={prompt.y}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received segmentation request: image_id={prompt.image_id}, x={prompt.x}, y={prompt.y}")
     
     image = session_store.get_image(session_id, prompt.image_id)
     if not image:
@@ -96,20 +148,6 @@ async def segment_from_point(
         timings = {}
         op_start = time.time()
 
-        # Determine if running in Docker
-        in_docker = os.path.exists('/.dockerenv')
-        timings['env_check'] = time.time() - op_start
-
-        # Define annotation directory
-        t0 = time.time()
-        if in_docker:
-            annotation_dir = Path("/app/annotations")
-        else:
-            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            annotation_dir = Path(os.path.join(base_dir, "annotations"))
-        annotation_dir.mkdir(exist_ok=True)
-        timings['annotation_dir'] = time.time() - t0
-
         # Get the image path from the session store
         t1 = time.time()
         stored_path = image.file_path
@@ -196,18 +234,18 @@ async def segment_from_point(
 
         # Save JSON
         t_save = time.time()
-        annotation_path = annotation_dir / f"annotation_{session_id}_{image.image_id}_{len(polygon)}.json"
-        with open(annotation_path, "w") as f:
-            json.dump({
-                "type": "Feature",
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [polygon]
-                },
-                "properties": {
-                    "cached": is_cached
-                }
-            }, f)
+        annotation_path = ANNOTATION_DIR / f"annotation_{session_id}_{image.image_id}_{len(polygon)}.json"
+        feature = {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [polygon]
+            },
+            "properties": {
+                "cached": is_cached
+            }
+        }
+        await run_in_threadpool(write_json, annotation_path, feature, indent=False)
         timings['save_json'] = time.time() - t_save
 
         # Add annotation to session store
@@ -216,7 +254,8 @@ async def segment_from_point(
             session_id=session_id,
             image_id=image.image_id,
             file_path=str(annotation_path),
-            auto_generated=True
+            auto_generated=True,
+            data=feature
         )
         timings['add_annotation'] = time.time() - t_ann
 
@@ -254,12 +293,50 @@ async def get_mask_image(session_id: str, image_id: str, mask_type: str):
         raise HTTPException(status_code=404, detail=f"{mask_type} image not found")
     return FileResponse(mask_path, media_type="image/png", filename=f"{mask_type}_{session_id}_{image_id}.png")
 
-@router.get("/annotations/{image_id}")
+def annotation_entry(ann, json_data):
+    """Build the API representation of an annotation"""
+    return {
+        "annotation_id": ann.annotation_id,
+        "created_at": ann.created_at,
+        "auto_generated": ann.auto_generated,
+        "data": json_data
+    }
+
+def load_annotation_entry(ann):
+    """Load the stored GeoJSON for an annotation, or return None if its file is missing"""
+    try:
+        st = os.stat(ann.file_path)
+    except FileNotFoundError:
+        return None
+    return annotation_entry(ann, load_annotation_file(ann.file_path, st.st_mtime_ns, st.st_size))
+
+async def stream_annotation_lines(annotations):
+    """Yield annotations one at a time as newline-delimited JSON"""
+    for ann in annotations:
+        if ann.data is not None:
+            entry = annotation_entry(ann, ann.data)
+        else:
+            try:
+                entry = await run_in_threadpool(load_annotation_entry, ann)
+            except Exception as e:
+                logger.error(f"Error loading annotation {ann.annotation_id}: {e}")
+                continue
+            if entry is None:
+                continue
+        yield dumps_json(entry) + b"\n"
+
+@router.get("/annotations/{image_id}", response_class=AnnotationJSONResponse)
 async def get_image_annotations(
     image_id: str,
+    stream: bool = False,
     session_manager: SessionManager = Depends(get_session_manager)
 ):
-    """Get all annotations for a specific image"""
+    """
+    Get all annotations for a specific image.
+    
+    With ?stream=true the annotations are streamed as newline-delimited JSON
+    (application/x-ndjson) instead of being returned as a single JSON array.
+    """
     session_id = session_manager.session_id
     image = session_store.get_image(session_id, image_id)
     if not image:
@@ -267,27 +344,29 @@ async def get_image_annotations(
     
     annotations = session_store.get_annotations(session_id, image_id)
     
+    if stream:
+        return StreamingResponse(stream_annotation_lines(annotations), media_type="application/x-ndjson")
+    
+    # Annotations keep their GeoJSON in memory; the disk fallback is legacy
+    # and only applies to annotations added to the store without data
+    on_disk = [ann for ann in annotations if ann.data is None]
+    entries = await asyncio.gather(
+        *(run_in_threadpool(load_annotation_entry, ann) for ann in on_disk),
+        return_exceptions=True
+    )
+    loaded = {}
+    for ann, entry in zip(on_disk, entries):
+        if isinstance(entry, Exception):
+            logger.error(f"Error loading annotation {ann.annotation_id}: {entry}")
+        elif entry is not None:
+            loaded[ann.annotation_id] = entry
+    
     result = []
     for ann in annotations:
-        try:
-            file_path = ann.file_path
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    json_data = json.load(f)                # DEBUG: Log what we're loading
-                if json_data.get('features') and len(json_data['features']) > 0:
-                    feature = json_data['features'][0]
-                    if feature.get('geometry', {}).get('coordinates'):
-                        coords = feature['geometry']['coordinates']
-                
-                result.append({
-                    "annotation_id": ann.annotation_id,
-                    "created_at": ann.created_at,
-                    "auto_generated": ann.auto_generated,
-                    "data": json_data
-                })
-        except Exception as e:
-            logger.error(f"Error loading annotation {ann.annotation_id}: {e}")
-            continue
+        if ann.data is not None:
+            result.append(annotation_entry(ann, ann.data))
+        elif ann.annotation_id in loaded:
+            result.append(loaded[ann.annotation_id])
     
     return result
 
@@ -323,16 +402,12 @@ async def save_manual_annotation(
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
+    annotation_id = annotation_data.id
+    if (not annotation_id or len(annotation_id) > MAX_ANNOTATION_ID_LENGTH
+            or not UNSAFE_ID_CHARS.isdisjoint(annotation_id)):
+        raise HTTPException(status_code=400, detail="Invalid annotation ID")
+    
     try:
-        # Define annotation directory
-        in_docker = os.path.exists('/.dockerenv')
-        if in_docker:
-            annotation_dir = Path("/app/annotations")
-        else:
-            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            annotation_dir = Path(os.path.join(base_dir, "annotations"))
-        annotation_dir.mkdir(exist_ok=True)
-        
         # Create JSON format for the annotation
         json_data = {
             "type": "FeatureCollection",
@@ -352,23 +427,23 @@ async def save_manual_annotation(
             ]
         }
           # Save annotation file
-        annotation_path = annotation_dir / f"manual_{session_id}_{annotation_data.image_id}_{annotation_data.id}.json"
-        with open(annotation_path, "w") as f:
-            json.dump(json_data, f, indent=2)
+        annotation_path = ANNOTATION_DIR / f"manual_{session_id}_{annotation_data.image_id}_{annotation_id}.json"
+        await run_in_threadpool(write_json, annotation_path, json_data)
         
         # Add annotation to session store
         annotation = session_store.add_annotation(
             session_id,
             annotation_data.image_id,
-            annotation_id=annotation_data.id,
+            annotation_id=annotation_id,
             file_path=str(annotation_path),
-            auto_generated=False
+            auto_generated=False,
+            data=json_data
         )
         
         return AnnotationResponse(
             success=True,
             message="Annotation saved successfully",
-            annotation_id=annotation.annotation_id if annotation else annotation_data.id
+            annotation_id=annotation.annotation_id if annotation else annotation_id
         )
         
     except Exception as e:
@@ -393,11 +468,14 @@ async def update_annotation(
         raise HTTPException(status_code=404, detail="Annotation not found")
     
     try:        # Load existing annotation data
-        if not os.path.exists(annotation.file_path):
-            raise HTTPException(status_code=404, detail="Annotation file not found")
-        
-        with open(annotation.file_path, 'r') as f:
-            json_data = json.load(f)
+        if annotation.data is not None:
+            # Edit a copy so a failed write leaves the served data matching disk
+            json_data = copy.deepcopy(annotation.data)
+        else:
+            if not os.path.exists(annotation.file_path):
+                raise HTTPException(status_code=404, detail="Annotation file not found")
+            
+            json_data = await run_in_threadpool(read_json, annotation.file_path)
         
         # Update the data
         if json_data.get("features"):
@@ -412,8 +490,8 @@ async def update_annotation(
             # Update modified timestamp
             feature["properties"]["modified"] = datetime.now().isoformat()
           # Save updated annotation
-        with open(annotation.file_path, "w") as f:
-            json.dump(json_data, f, indent=2)
+        await run_in_threadpool(write_json, annotation.file_path, json_data)
+        annotation.data = json_data
         
         return AnnotationResponse(
             success=True,
@@ -69,9 +69,12 @@ class SessionManager:
         )
 
 
-def get_session_manager(request: Request, response: Response) -> SessionManager:
+async def get_session_manager(request: Request, response: Response) -> SessionManager:
     """
     FastAPI dependency to get the session manager.
     Usage: session_manager: SessionManager = Depends(get_session_manager)
+    
+    Declared async (it does no blocking work) so FastAPI runs it on the event
+    loop instead of dispatching it to the threadpool on every request.
     """
     return SessionManager(request, response)
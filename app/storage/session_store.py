@@ -1,7 +1,7 @@
 import uuid
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class SessionImage(BaseModel):
@@ -21,6 +21,9 @@ class SessionAnnotation(BaseModel):
     created_at: datetime = datetime.now()
     auto_generated: bool = False
     model_id: Optional[str] = None
+    # GeoJSON kept in memory to avoid re-reading file_path; excluded from
+    # serialization so session exports keep their existing shape
+    data: Optional[Dict[str, Any]] = Field(default=None, exclude=True)
 
 
 class SessionStore:
@@ -78,7 +81,8 @@ class SessionStore:
         
     def add_annotation(self, session_id: str, image_id: str, file_path: str,
                       auto_generated: bool = False, model_id: Optional[str] = None, 
-                      annotation_id: Optional[str] = None) -> Optional[SessionAnnotation]:
+                      annotation_id: Optional[str] = None,
+                      data: Optional[Dict[str, Any]] = None) -> Optional[SessionAnnotation]:
         """Add annotation to session and return the created annotation object"""
         if session_id not in self.sessions or image_id not in self.sessions[session_id]["images"]:
             return None
@@ -92,7 +96,8 @@ class SessionStore:
             image_id=image_id,
             file_path=file_path,
             auto_generated=auto_generated,
-            model_id=model_id
+            model_id=model_id,
+            data=data
         )
         
         self.sessions[session_id]["annotations"][annotation_id] = annotation
@@ -19,6 +19,9 @@ class MockSAMModel:
     
     def to(self, device=None):
         return self
+    
+    def eval(self):
+        return self
 
 def mock_model_constructor(checkpoint):
     return MockSAMModel(checkpoint)
@@ -61,7 +64,8 @@ mock_torch.cuda.is_available = lambda: False
 mock_image = np.zeros((768, 1024, 3), dtype=np.uint8)
 
 # Setup mock for cv2
-mock_cv2.imread = lambda path: mock_image
+mock_cv2.imread = lambda path, flags=None: mock_image
+mock_cv2.IMREAD_COLOR_RGB = 256
 mock_cv2.cvtColor = lambda img, code: img
 mock_cv2.findContours = lambda mask, mode, method: (
     [np.array([[[400, 300]], [[600, 300]], [[600, 500]], [[400, 500]]], dtype=np.int32)], 
@@ -69,6 +73,7 @@ mock_cv2.findContours = lambda mask, mode, method: (
 )
 mock_cv2.RETR_EXTERNAL = 0
 mock_cv2.CHAIN_APPROX_SIMPLE = 1
+mock_cv2.CHAIN_APPROX_TC89_KCOS = 4
 mock_cv2.contourArea = lambda contour: 40000  # 200x200 area
 mock_cv2.imwrite = lambda path, img: True
 mock_cv2.applyColorMap = lambda mask, colormap: mock_image
@@ -9,6 +9,8 @@ import unittest
 import sys
 import os
 import io
+import errno
+import tempfile
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
@@ -24,7 +26,8 @@ os.environ["SAT_ANNOTATOR_TEST_MODE"] = "1"
 sys.modules['PIL'] = MagicMock()
 
 # Import application code
-from utils.image_processing import validate_image_file
+import numpy as np
+from utils.image_processing import validate_image_file, _normalize_to_u8, _read_tiff_array, _tiff_array_to_u8, _copy_spooled_upload, tifffile
 
 class MockUploadFile:
     """Mock class for FastAPI's UploadFile"""
@@ -33,9 +36,8 @@ class MockUploadFile:
         self.content_type = content_type
         self.file = io.BytesIO(content or b"mock content")
     
-    async def read(self):
-        self.file.seek(0)
-        return self.file.read()
+    async def read(self, size=-1):
+        return self.file.read(size)
 
 class TestImageProcessing(unittest.TestCase):
     """Tests for image processing utilities"""
@@ -71,6 +73,104 @@ class TestImageProcessing(unittest.TestCase):
                 f"validate_image_file should return False for {content_type}"
             )
     
+    def test_normalize_to_u8(self):
+        """Test stretching high bit depth data to the uint8 range"""
+        data = np.array([[1000, 2000], [3000, 5000]], dtype=np.uint16)
+        result = _normalize_to_u8(data, 0.0, 100.0)
+        
+        self.assertEqual(result.dtype, np.uint8)
+        self.assertEqual(result.shape, data.shape)
+        self.assertEqual(result.min(), 0)
+        self.assertEqual(result.max(), 255)
+        
+        # Constant and NaN-containing inputs must not produce garbage
+        self.assertTrue(np.all(_normalize_to_u8(np.full((4, 4), 7, dtype=np.uint16), 0.0, 100.0) == 0))
+        floats = np.array([[0.0, np.nan], [0.5, 1.0]], dtype=np.float32)
+        self.assertEqual(_normalize_to_u8(floats, 0.0, 100.0).tolist(), [[0, 0], [127, 255]])
+        
+        # Multi-band data is stretched per band
+        bands = np.stack([data, data // 10, np.full_like(data, 3)], axis=-1)
+        result = _normalize_to_u8(bands, 0.0, 100.0)
+        self.assertEqual(result[..., 0].tolist(), result[..., 1].tolist())
+        self.assertEqual((result[..., 0].min(), result[..., 0].max()), (0, 255))
+        self.assertTrue(np.all(result[..., 2] == 0))
+        
+        # Percentile stretching ignores an outlier that would squash the range
+        ramp = np.arange(100, dtype=np.float32).reshape(10, 10)
+        ramp[0, 0] = 1e6
+        result = _normalize_to_u8(ramp, 2.0, 98.0)
+        self.assertEqual(result[0, 0], 255)
+        self.assertEqual(result[9, 9], 255)
+        self.assertEqual(result[0, 1], 0)
+        self.assertGreater(result[5, 0], 100)
+    
+    def test_tiff_array_to_u8_keeps_alpha(self):
+        """Test that 16-bit RGBA data stretches colour but keeps opaque alpha opaque"""
+        rgba = np.zeros((64, 64, 4), dtype=np.uint16)
+        rgba[..., :3] = np.arange(64 * 64, dtype=np.uint16).reshape(64, 64, 1) * 10
+        rgba[..., 3] = 65535
+        rgba[0, 0, 3] = 0
+        
+        result = _tiff_array_to_u8(rgba)
+        
+        self.assertEqual(result.dtype, np.uint8)
+        self.assertEqual(result.shape, (64, 64, 4))
+        self.assertEqual(result[..., 3].min(), 0)
+        self.assertTrue(np.all(result[1:, :, 3] == 255))
+        self.assertEqual((result[..., 0].min(), result[..., 0].max()), (0, 255))
+    
+    @unittest.skipIf(tifffile is None, "tifffile not installed")
+    def test_read_tiff_array(self):
+        """Test decoding TIFFs with tifffile, deferring unusual layouts to PIL"""
+        with tempfile.TemporaryDirectory() as tmp:
+            gray_path = Path(tmp) / "gray.tif"
+            data = np.arange(64 * 48, dtype=np.uint16).reshape(48, 64)
+            tifffile.imwrite(gray_path, data, tile=(16, 16))
+            np.testing.assert_array_equal(_read_tiff_array(gray_path), data)
+            
+            # Band-sequential RGB is returned interleaved
+            planar = np.arange(3 * 48 * 64, dtype=np.uint16).reshape(3, 48, 64)
+            planar_path = Path(tmp) / "planar.tif"
+            tifffile.imwrite(planar_path, planar, photometric='rgb', planarconfig='separate')
+            result = _read_tiff_array(planar_path)
+            self.assertEqual(result.shape, (48, 64, 3))
+            np.testing.assert_array_equal(result, np.moveaxis(planar, 0, -1))
+            
+            # A 4th sample is only kept as alpha when tagged as such; an
+            # unspecified extra band (e.g. NIR) is dropped
+            rgbn = np.full((48, 64, 4), 7, dtype=np.uint8)
+            nir_path = Path(tmp) / "rgbn.tif"
+            tifffile.imwrite(nir_path, rgbn, photometric='rgb', extrasamples=[0])
+            self.assertEqual(_read_tiff_array(nir_path).shape, (48, 64, 3))
+            alpha_path = Path(tmp) / "rgba.tif"
+            tifffile.imwrite(alpha_path, rgbn, photometric='rgb', extrasamples=[2])
+            self.assertEqual(_read_tiff_array(alpha_path).shape, (48, 64, 4))
+            
+            # Multi-sample grayscale is left to PIL
+            gray4_path = Path(tmp) / "gray4.tif"
+            tifffile.imwrite(gray4_path, rgbn, photometric='minisblack', planarconfig='contig')
+            self.assertIsNone(_read_tiff_array(gray4_path))
+    
+    def test_copy_spooled_upload_falls_back(self):
+        """Test that a copy_file_range failure mid-copy restarts with a userspace copy"""
+        content = os.urandom(3 * 1024 * 1024 + 17)
+        
+        def cross_device_copy(src_fd, dst_fd, count):
+            # Fail mid-chunk (as overlayfs -> bind mount can), leaving the
+            # source offset ahead of the bytes written to the destination
+            os.write(dst_fd, os.read(src_fd, 8192)[:4096])
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        
+        with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryFile() as src:
+            src.write(content)
+            dst_path = Path(tmp) / "upload.tif"
+            
+            with patch('os.copy_file_range', side_effect=cross_device_copy, create=True) as mock_copy:
+                _copy_spooled_upload(src, dst_path)
+            
+            mock_copy.assert_called_once()
+            self.assertEqual(dst_path.read_bytes(), content)
+    
     @patch('builtins.open', MagicMock())
     @patch('os.path.getsize', MagicMock(return_value=1024))
     @patch('pathlib.Path.mkdir', MagicMock())
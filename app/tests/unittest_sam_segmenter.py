@@ -8,6 +8,7 @@ Unit tests for the SAM (Segment Anything Model) wrapper
 import unittest
 import sys
 import os
+import tempfile
 import numpy as np
 from pathlib import Path
 from unittest.mock import patch, MagicMock
@@ -36,7 +37,7 @@ class TestSAMSegmenter(unittest.TestCase):
         self.segmenter = SAMSegmenter()
         
         # Create test data
-        self.test_image_path = "/fake/path/image.jpg"
+        self.test_image_path = "/fake/path/image.png"
         self.test_point = [500, 400]
     
     def test_segmenter_initialization(self):
@@ -63,6 +64,86 @@ class TestSAMSegmenter(unittest.TestCase):
         self.assertIn(self.test_image_path, self.segmenter.cache)
         self.assertEqual(self.segmenter.cache[self.test_image_path]['image_size'], (768, 1024))
     
+    @patch("utils.sam_model.IMREAD_COLOR_RGB", None)
+    @patch("cv2.imread")
+    @patch("cv2.cvtColor")
+    def test_set_image_without_imread_color_rgb(self, mock_cvtcolor, mock_imread):
+        """Test the BGR->RGB fallback for OpenCV builds without IMREAD_COLOR_RGB"""
+        mock_img = np.zeros((768, 1024, 3), dtype=np.uint8)
+        mock_imread.return_value = mock_img
+        mock_cvtcolor.return_value = mock_img
+        
+        result = self.segmenter.set_image(self.test_image_path)
+        
+        mock_imread.assert_called_once_with(self.test_image_path)
+        mock_cvtcolor.assert_called_once()
+        self.assertEqual(result, (768, 1024))
+    
+    def test_set_image_uses_disk_embedding_cache(self):
+        """Test that a persisted embedding is reused without decoding the image"""
+        with tempfile.TemporaryDirectory() as tmp:
+            image_path = os.path.join(tmp, "image.png")
+            with open(image_path, "wb") as f:
+                f.write(b"image bytes")
+            self.segmenter.embedding_cache_dir = Path(tmp) / "embeddings"
+            cache_path = self.segmenter._embedding_cache_path(image_path)
+            cache_path.parent.mkdir()
+            cache_path.touch()
+            
+            state = {'features': MagicMock(), 'original_size': (768, 1024), 'input_size': (768, 1024)}
+            with patch("utils.sam_model.torch.load", return_value=state) as mock_torch_load, \
+                 patch("utils.sam_model.load_image_rgb") as mock_load:
+                result = self.segmenter.set_image(image_path)
+            
+            mock_load.assert_not_called()
+            self.assertTrue(mock_torch_load.call_args.kwargs['weights_only'])
+            self.assertEqual(result, (768, 1024))
+            # Possibly-FP16 features from a CUDA run are upcast on CPU
+            self.assertIs(self.segmenter.predictor.features, state['features'].float.return_value)
+            self.assertTrue(self.segmenter.predictor.is_image_set)
+    
+    @patch("utils.sam_model.Image")
+    @patch("utils.sam_model.load_image_rgb")
+    def test_set_image_downscales_large_images_on_cpu(self, mock_load, mock_image):
+        """Test that very large images are resized before SAM on CPU"""
+        mock_load.return_value = np.zeros((3072, 4096, 3), dtype=np.uint8)
+        resized = np.zeros((768, 1024, 3), dtype=np.uint8)
+        mock_image.fromarray.return_value.resize.return_value = resized
+        
+        result = self.segmenter.set_image(self.test_image_path)
+        
+        self.assertEqual(mock_image.fromarray.return_value.resize.call_args[0][0], (1024, 768))
+        self.assertIs(self.segmenter.predictor.image, resized)
+        self.assertEqual(result, (768, 1024))
+    
+    @patch("utils.sam_model.MAX_EMBEDDING_CACHE_FILES", 2)
+    def test_prune_embedding_cache(self):
+        """Test that the oldest on-disk embeddings are removed beyond the limit"""
+        with tempfile.TemporaryDirectory() as tmp:
+            self.segmenter.embedding_cache_dir = Path(tmp)
+            for age, name in enumerate(["newest.pt", "middle.pt", "oldest.pt"]):
+                path = Path(tmp) / name
+                path.touch()
+                os.utime(path, ns=(10**18 - age * 10**9, 10**18 - age * 10**9))
+            
+            self.segmenter._prune_embedding_cache()
+            
+            self.assertEqual(sorted(p.name for p in Path(tmp).iterdir()), ["middle.pt", "newest.pt"])
+    
+    @patch("utils.sam_model.ImageOps")
+    @patch("utils.sam_model.Image")
+    def test_set_image_jpeg_uses_draft(self, mock_image, mock_imageops):
+        """Test that JPEGs are decoded at reduced scale via PIL's draft mode"""
+        mock_img = MagicMock()
+        mock_image.open.return_value.__enter__.return_value = mock_img
+        mock_imageops.exif_transpose.return_value.convert.return_value = np.zeros((768, 1024, 3), dtype=np.uint8)
+        
+        result = self.segmenter.set_image("/fake/path/photo.JPG")
+        
+        mock_img.draft.assert_called_once_with('RGB', (1024, 1024))
+        mock_imageops.exif_transpose.assert_called_once_with(mock_img)
+        self.assertEqual(result, (768, 1024))
+    
     @patch("cv2.imread")
     @patch("cv2.cvtColor")
     def test_predict_from_point(self, mock_cvtcolor, mock_imread):
@@ -92,7 +173,7 @@ class TestSAMSegmenter(unittest.TestCase):
         
         # Check the results
         self.assertEqual(result.shape, (768, 1024))
-        self.assertTrue(np.array_equal(result[300:500, 400:600], np.ones((200, 200), dtype=np.uint8) * 255))
+        self.assertTrue(np.array_equal(result[300:500, 400:600], np.ones((200, 200), dtype=np.uint8)))
         self.assertTrue(np.array_equal(result[0:300, 0:400], np.zeros((300, 400), dtype=np.uint8)))
         
         # Check that the result was cached
@@ -120,6 +201,59 @@ class TestSAMSegmenter(unittest.TestCase):
         self.assertEqual(result[2], [600, 500])
         self.assertEqual(result[3], [400, 500])
     
+    @patch("cv2.contourArea")
+    @patch("cv2.findContours")
+    def test_mask_to_polygon_picks_largest_contour(self, mock_findcontours, mock_contourarea):
+        """Test that the largest of several contours is returned"""
+        small = np.array([[[0, 0]], [[10, 0]], [[10, 10]]])
+        large = np.array([[[400, 300]], [[600, 300]], [[600, 500]], [[400, 500]]])
+        mock_findcontours.return_value = ((small, large), None)
+        mock_contourarea.side_effect = lambda c: 50.0 if c is small else 40000.0
+        
+        result = self.segmenter.mask_to_polygon(np.zeros((768, 1024), dtype=np.uint8))
+        
+        self.assertEqual(result, large.reshape(-1, 2).tolist())
+    
+    def test_predict_from_points_batch(self):
+        """Test that uncached points are decoded together in one batched call"""
+        self.segmenter._add_to_cache(self.test_image_path, (768, 1024))
+        self.segmenter.current_image_path = self.test_image_path
+        self.segmenter._last_set_image = self.test_image_path
+        cached_mask = np.full((768, 1024), 255, dtype=np.uint8)
+        self.segmenter._cache_mask((1, 2), cached_mask)
+        
+        # Two new prompts produce two best masks from predict_torch
+        new_masks = np.zeros((2, 768, 1024), dtype=bool)
+        new_masks[0, 0:10, 0:10] = True
+        torch_masks = MagicMock()
+        torch_masks.__getitem__.return_value.cpu.return_value.numpy.return_value = new_masks
+        self.segmenter.predictor.transform = MagicMock()
+        self.segmenter.predictor.original_size = (768, 1024)
+        self.segmenter.predictor.predict_torch = MagicMock(return_value=(torch_masks, MagicMock(), None))
+        
+        result = self.segmenter.predict_from_points_batch([[500, 400], [1, 2], [600, 300], [500, 400]])
+        
+        self.segmenter.predictor.predict_torch.assert_called_once()
+        self.assertEqual(len(result), 4)
+        self.assertIs(result[1], cached_mask)
+        self.assertIs(result[0], result[3])
+        self.assertEqual(result[0][5, 5], 1)
+        self.assertEqual(result[2].max(), 0)
+        self.assertIn((600, 300), self.segmenter.cache[self.test_image_path]['masks'])
+    
+    @patch("utils.sam_model.MAX_CACHED_IMAGES", 2)
+    def test_cache_evicts_least_recently_used(self):
+        """Test that the image cache is bounded with LRU eviction"""
+        self.segmenter._add_to_cache("image1.jpg", (768, 1024))
+        self.segmenter._add_to_cache("image2.jpg", (768, 1024))
+        
+        # Touch image1 so image2 becomes the least recently used entry
+        self.segmenter.current_image_path = "image2.jpg"
+        self.segmenter.set_image("image1.jpg")
+        self.segmenter._add_to_cache("image3.jpg", (768, 1024))
+        
+        self.assertEqual(list(self.segmenter.cache), ["image1.jpg", "image3.jpg"])
+    
     def test_clear_cache(self):
         """Test clearing the segmenter cache"""
         # Set up test data in the cache
@@ -9,6 +9,7 @@ import unittest
 import sys
 import os
 import uuid
+import tempfile
 import numpy as np
 from pathlib import Path
 from unittest.mock import patch, MagicMock
@@ -17,6 +18,9 @@ from unittest.mock import patch, MagicMock
 app_path = Path(__file__).parent.parent
 if str(app_path) not in sys.path:
     sys.path.insert(0, str(app_path))
+# The routers import the app package itself, so the project root is needed too
+if str(app_path.parent) not in sys.path:
+    sys.path.insert(0, str(app_path.parent))
 
 # Set test mode environment variable
 os.environ["SAT_ANNOTATOR_TEST_MODE"] = "1"
@@ -185,6 +189,65 @@ class TestSegmentationAPI(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertEqual(data["image_id"], self.test_image.image_id)
 
+class TestManualAnnotationIDs(unittest.TestCase):
+    """Tests for annotation ID validation in the real session_segmentation router"""
+    
+    def setUp(self):
+        """Mount the router against a temporary annotation directory"""
+        from app.routers import session_segmentation
+        from app.storage.session_store import session_store as app_session_store
+        
+        self.store = app_session_store
+        self.store.sessions = {}
+        self.test_session_id = str(uuid.uuid4())
+        self.store.create_session(self.test_session_id)
+        self.test_image = self.store.add_image(
+            session_id=self.test_session_id,
+            file_name="test.jpg",
+            file_path="uploads/test.jpg",
+            resolution="1024x768"
+        )
+        
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.annotation_dir = Path(tmp.name)
+        patcher = patch.object(session_segmentation, "ANNOTATION_DIR", self.annotation_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        app = FastAPI()
+        app.include_router(session_segmentation.router, prefix="/api")
+        self.client = TestClient(app)
+        self.client.cookies.set(SESSION_COOKIE_NAME, self.test_session_id)
+    
+    def save(self, annotation_id):
+        return self.client.post("/api/annotations/", json={
+            "image_id": self.test_image.image_id,
+            "id": annotation_id,
+            "polygon": [[0.1, 0.1], [0.2, 0.1], [0.2, 0.2]],
+            "label": "building"
+        })
+    
+    def test_valid_id_is_saved(self):
+        """Test that a frontend-style ID is stored under the annotation directory"""
+        response = self.save("id_abc123")
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["annotation_id"], "id_abc123")
+        self.assertEqual(len(list(self.annotation_dir.glob("*id_abc123.json"))), 1)
+    
+    def test_invalid_ids_are_rejected(self):
+        """Test that path separators, empty and over-long IDs get a 400 and write nothing"""
+        from app.routers.session_segmentation import MAX_ANNOTATION_ID_LENGTH
+        
+        for annotation_id in ("../../etc/x", "a/b", "a:b", "a\\b", "", "x" * (MAX_ANNOTATION_ID_LENGTH + 1)):
+            with self.subTest(annotation_id=annotation_id):
+                response = self.save(annotation_id)
+                self.assertEqual(response.status_code, 400)
+        
+        self.assertEqual(list(self.annotation_dir.iterdir()), [])
+        self.assertEqual(self.store.get_annotations(self.test_session_id, self.test_image.image_id), [])
+
 if __name__ == "__main__":
     print("Running segmentation API tests...")
     print(f"App path: {app_path}")
@@ -192,13 +255,13 @@ if __name__ == "__main__":
     
     try:
         # Create test suite explicitly
-        test_methods = [m for m in dir(TestSegmentationAPI) if m.startswith('test_')]
-        print(f"Found {len(test_methods)} test methods:")
-        
         suite = unittest.TestSuite()
-        for method in test_methods:
-            print(f"  - {method}")
-            suite.addTest(TestSegmentationAPI(method))
+        for test_class in (TestSegmentationAPI, TestManualAnnotationIDs):
+            test_methods = [m for m in dir(test_class) if m.startswith('test_')]
+            print(f"Found {len(test_methods)} test methods in {test_class.__name__}:")
+            for method in test_methods:
+                print(f"  - {method}")
+                suite.addTest(test_class(method))
         
         # Run tests with clear output
         runner = unittest.TextTestRunner(verbosity=2)
@@ -41,9 +41,8 @@ class MockUploadFile:
         self.content_type = content_type
         self.file = io.BytesIO(content or b"mock image content")
     
-    async def read(self):
-        self.file.seek(0)
-        return self.file.read()
+    async def read(self, size=-1):
+        return self.file.read(size)
     
     def __enter__(self):
         return self
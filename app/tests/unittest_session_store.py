@@ -78,6 +78,32 @@ class TestSessionStore(unittest.TestCase):
         annotations = self.store.get_annotations(self.session_id)
         self.assertEqual(len(annotations), 1)
         self.assertEqual(annotations[0].file_path, "annotations/test.json")
+        self.assertIsNone(annotations[0].data)
+    
+    def test_add_annotation_with_data(self):
+        """Test that annotation GeoJSON is kept in memory when provided"""
+        image = self.store.add_image(
+            session_id=self.session_id,
+            file_name="test.jpg",
+            file_path="uploads/test.jpg"
+        )
+        geojson = {
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [[[0.1, 0.2], [0.3, 0.4], [0.5, 0.6]]]},
+            "properties": {}
+        }
+        
+        annotation = self.store.add_annotation(
+            session_id=self.session_id,
+            image_id=image.image_id,
+            file_path="annotations/test.json",
+            data=geojson
+        )
+        
+        stored = self.store.get_annotation(self.session_id, annotation.annotation_id)
+        self.assertEqual(stored.data, geojson)
+        # The cached GeoJSON is internal and must not leak into session exports
+        self.assertNotIn("data", stored.dict())
 
 if __name__ == "__main__":
     print("Running tests...")
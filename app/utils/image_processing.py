@@ -1,10 +1,20 @@
 import os
+import shutil
 import uuid
 import logging
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Optional, Tuple
+import numpy as np
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 from PIL import Image
 
+try:
+    import tifffile
+except ImportError:  # tifffile is optional - fall back to PIL's libtiff decoder
+    tifffile = None
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
@@ -20,54 +30,216 @@ else:
 
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Extensions that are converted to PNG for browser compatibility
+TIFF_EXTENSIONS = frozenset({'.tif', '.tiff'})
+
+# TIFF ExtraSamples values marking a 4th RGB sample as alpha (associated, unassociated)
+TIFF_ALPHA_EXTRASAMPLES = frozenset({1, 2})
+
+# PIL modes with more than 8 bits per sample; convert('RGB') would clip these
+HIGH_BIT_DEPTH_MODES = frozenset({'I', 'I;16', 'I;16B', 'I;16L', 'I;16N', 'F'})
+
+# Percentile range for stretching high bit depth TIFFs, so nodata sentinels
+# and saturated pixels do not squash the useful dynamic range
+TIFF_STRETCH_PERCENTILES = (2.0, 98.0)
+PERCENTILE_SAMPLE_PIXELS = 1 << 20
+# Normalization works through the image in blocks of about this many values
+NORMALIZE_BLOCK_PIXELS = 1 << 20
+
+# MIME types accepted by the upload endpoint
+VALID_CONTENT_TYPES = frozenset({"image/jpeg", "image/png", "image/tiff", "image/geotiff"})
+
+# Uploads are copied to disk in chunks of this size to keep memory bounded
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+def _normalize_to_u8(arr: np.ndarray, p_low: float, p_high: float) -> np.ndarray:
+    """Linearly stretch each band of an (H, W) or (H, W, C) array to 0-255.
+    
+    Values outside the per-band [p_low, p_high] percentiles are clipped.
+    """
+    # Per-band statistics, broadcastable against the array
+    axes = (0, 1) if arr.ndim == 3 else None
+    is_float = np.issubdtype(arr.dtype, np.floating)
+    # Percentiles need a sort; estimate them from a ~1 MP strided sample
+    step = max(1, int((arr.shape[0] * arr.shape[1] / PERCENTILE_SAMPLE_PIXELS) ** 0.5))
+    percentile = np.nanpercentile if is_float else np.percentile
+    mn, mx = percentile(arr[::step, ::step], [p_low, p_high], axis=axes, keepdims=True)
+    # Take the range in float64 so wide integer types cannot overflow
+    mn = mn.astype(np.float64)
+    scale = (255.0 / np.maximum(mx.astype(np.float64) - mn, 1e-12)).astype(np.float32)
+    mn = mn.astype(np.float32)
+    
+    out = np.empty(arr.shape, dtype=np.uint8)
+    
+    def normalize_rows(start: int) -> None:
+        # Each block gets its own small float32 scratch buffer; NumPy releases
+        # the GIL for these ufuncs, so blocks run in parallel across threads
+        rows = slice(start, start + block_rows)
+        buf = np.subtract(arr[rows], mn, dtype=np.float32)
+        buf *= scale
+        np.clip(buf, 0.0, 255.0, out=buf)
+        if is_float:
+            np.nan_to_num(buf, copy=False)
+        out[rows] = buf
+    
+    block_rows = max(1, NORMALIZE_BLOCK_PIXELS // max(1, arr[0].size))
+    starts = range(0, arr.shape[0], block_rows)
+    if len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=min(len(starts), os.cpu_count() or 1)) as executor:
+            list(executor.map(normalize_rows, starts))
+    else:
+        normalize_rows(0)
+    return out
+
+def _read_tiff_array(tiff_path: Path) -> Optional[np.ndarray]:
+    """Decode the first TIFF page with tifffile, using all cores for tiled/striped data.
+    
+    Returns None for layouts better left to PIL (palette, YCbCr, bilevel,
+    multi-sample grayscale...). Planar RGB pages are returned interleaved as
+    (H, W, S), since PIL misreads their high bit depth samples. RGB pages keep
+    a 4th sample only when it is tagged as alpha; unspecified extra samples
+    (e.g. NIR in multispectral GeoTIFFs) are dropped rather than being saved
+    as transparency.
+    """
+    with tifffile.TiffFile(tiff_path) as tif:
+        page = tif.pages[0]
+        if page.dtype is None or page.dtype == np.bool_:
+            return None
+        if page.axes == 'YX' and page.photometric == tifffile.PHOTOMETRIC.MINISBLACK:
+            return page.asarray(maxworkers=os.cpu_count())
+        if page.photometric != tifffile.PHOTOMETRIC.RGB or page.axes not in ('YXS', 'SYX'):
+            return None
+        planar = page.axes == 'SYX'
+        if page.shape[0 if planar else -1] < 3:
+            return None
+        
+        has_alpha = bool(page.extrasamples) and page.extrasamples[0] in TIFF_ALPHA_EXTRASAMPLES
+        bands = 4 if has_alpha else 3
+        arr = page.asarray(maxworkers=os.cpu_count())
+        if planar:
+            arr = np.moveaxis(arr, 0, -1)
+        if arr.shape[-1] != bands or not arr.flags.c_contiguous:
+            arr = np.ascontiguousarray(arr[..., :bands])
+        return arr
+
+def _tiff_array_to_u8(arr: np.ndarray) -> np.ndarray:
+    """Convert a decoded TIFF array (grayscale, RGB or RGBA) to uint8 for PNG output."""
+    if arr.dtype == np.uint8:
+        return arr
+    if arr.ndim == 3 and arr.shape[2] == 4:
+        # Contrast-stretch the colour bands only; alpha is a coverage value, so
+        # scale it by the dtype's full range (a constant opaque band must stay opaque)
+        rgb = _normalize_to_u8(arr[..., :3], *TIFF_STRETCH_PERCENTILES)
+        return np.dstack((rgb, _alpha_to_u8(arr[..., 3])))
+    # Stretch 16-bit/float data (common in satellite TIFFs) into 8 bits
+    return _normalize_to_u8(arr, *TIFF_STRETCH_PERCENTILES)
+
+def _alpha_to_u8(alpha: np.ndarray) -> np.ndarray:
+    """Rescale an alpha band to 0-255 by its dtype range (floats are taken as 0-1)."""
+    if np.issubdtype(alpha.dtype, np.integer):
+        max_value = np.iinfo(alpha.dtype).max
+    else:
+        max_value = 1.0
+    scaled = np.clip(alpha.astype(np.float32) * np.float32(255.0 / max_value), 0.0, 255.0)
+    return np.nan_to_num(scaled, copy=False).round().astype(np.uint8)
+
+def _convert_tiff_to_png(tiff_path: Path, png_path: Path) -> Tuple[int, int]:
+    """Convert a TIFF file to a browser-compatible PNG and return its (width, height)."""
+    arr = None
+    if tifffile is not None:
+        try:
+            arr = _read_tiff_array(tiff_path)
+        except Exception as e:
+            logger.debug(f"tifffile could not decode {tiff_path.name}, using PIL: {e}")
+    
+    if arr is not None:
+        img = Image.fromarray(_tiff_array_to_u8(arr))  # L, RGB or RGBA
+        img.save(png_path, 'PNG', compress_level=1)
+        return img.size
+    
+    with Image.open(tiff_path) as img:
+        # Stretch 16-bit/float data (common in satellite TIFFs) into 8 bits
+        if img.mode in HIGH_BIT_DEPTH_MODES:
+            img = Image.fromarray(_normalize_to_u8(np.asarray(img), *TIFF_STRETCH_PERCENTILES))
+        # Convert to RGB if necessary (some TIFFs might be in different color modes);
+        # single-band images stay grayscale to avoid tripling the encoded bytes
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGB')
+        # Save as PNG (fast zlib level; the default spends far longer for a small size gain)
+        img.save(png_path, 'PNG', compress_level=1)
+        return img.size
+
+def _copy_spooled_upload(src, dst_path: Path) -> None:
+    """Copy an upload that is already spooled to disk, in-kernel where supported."""
+    src.seek(0)
+    with open(dst_path, "wb") as dst:
+        if hasattr(os, "copy_file_range"):
+            try:
+                # Uses and advances both descriptors' offsets; returns 0 at EOF
+                while os.copy_file_range(src.fileno(), dst.fileno(), 64 * UPLOAD_CHUNK_SIZE):
+                    pass
+                return
+            except OSError:
+                # Unsupported filesystem pair; start over with a userspace copy
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+
 async def save_upload_file(file: UploadFile) -> dict:
     """Save an uploaded file to the upload directory and convert TIFF to PNG if needed."""
     # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1].lower()
+    file_extension = PurePosixPath(file.filename).suffix.lower()
     temp_filename = f"{uuid.uuid4()}{file_extension}"
     
     # Create temporary file path
     temp_file_path = UPLOAD_DIR / temp_filename
     
-    # Save the original file temporarily
-    contents = await file.read()
-    with open(temp_file_path, "wb") as f:
-        f.write(contents)
+    # Save the original file temporarily, streaming it in chunks rather than
+    # holding a potentially multi-hundred-MB TIFF in memory
+    if getattr(file.file, "_rolled", False):
+        # Large uploads are spooled to a temp file; copy file-to-file instead
+        await run_in_threadpool(_copy_spooled_upload, file.file, temp_file_path)
+    else:
+        with open(temp_file_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await run_in_threadpool(f.write, chunk)
     
     # Check if we need to convert TIFF to PNG for browser compatibility
     final_file_path = temp_file_path
     final_filename = temp_filename
+    size = None
     
-    if file_extension in ['.tif', '.tiff']:
+    if file_extension in TIFF_EXTENSIONS:
         # Convert TIFF to PNG for browser compatibility
         png_filename = f"{uuid.uuid4()}.png"
         png_file_path = UPLOAD_DIR / png_filename
         
         try:
-            with Image.open(temp_file_path) as img:
-                # Convert to RGB if necessary (some TIFFs might be in different color modes)
-                if img.mode not in ('RGB', 'RGBA'):
-                    img = img.convert('RGB')
-                # Save as PNG
-                img.save(png_file_path, 'PNG')
-                
-                # Remove the temporary TIFF file
-                os.remove(temp_file_path)
-                  # Use the PNG file as the final file
-                final_file_path = png_file_path
-                final_filename = png_filename
+            # Decoding and encoding are CPU-bound; keep them off the event loop
+            size = await run_in_threadpool(_convert_tiff_to_png, temp_file_path, png_file_path)
+            
+            # Remove the temporary TIFF file once its handle is closed
+            os.remove(temp_file_path)
+            # Use the PNG file as the final file
+            final_file_path = png_file_path
+            final_filename = png_filename
         except Exception as e:
             # If conversion fails, keep the original TIFF file
             logger.warning(f"Failed to convert TIFF to PNG: {e}")
     
-    # Get image dimensions and resolution
+    # Get image dimensions and resolution; converted TIFFs already know theirs,
+    # so only sniff the header of files stored as uploaded
     resolution = None
-    try:
-        with Image.open(final_file_path) as img:
-            resolution = f"{img.width}x{img.height}"
-    except Exception:
-        # Not a valid image or PIL cannot read it
-        pass    
+    if size is None:
+        try:
+            with Image.open(final_file_path) as img:
+                size = (img.width, img.height)
+        except Exception:
+            # Not a valid image or PIL cannot read it
+            pass
+    if size is not None:
+        resolution = f"{size[0]}x{size[1]}"
     # Get file size
     file_size = os.path.getsize(final_file_path)
     
@@ -84,6 +256,4 @@ async def save_upload_file(file: UploadFile) -> dict:
 
 def validate_image_file(file: UploadFile) -> bool:
     """Validate if the file is a supported image format."""
-    content_type = file.content_type
-    valid_types = ["image/jpeg", "image/png", "image/tiff", "image/geotiff"]
-    return content_type in valid_types
\ No newline at end of file
+    return file.content_type in VALID_CONTENT_TYPES
\ No newline at end of file
@@ -2,29 +2,89 @@ import numpy as np
 import torch
 from segment_anything import sam_model_registry, SamPredictor
 import cv2
+from PIL import Image, ImageOps
 from pathlib import Path
 import os
+import hashlib
 import threading
 import logging
+from collections import OrderedDict
+from contextlib import ExitStack
+from functools import lru_cache
 from typing import Dict, Tuple, List, Optional
 
 # Set up logging for SAM model
 logger = logging.getLogger(__name__)
 
+# SAM resizes every input so that its longest side is 1024 pixels
+SAM_INPUT_SIZE = 1024
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+# OpenCV >= 4.10 can decode straight to RGB, skipping a full BGR->RGB pass
+IMREAD_COLOR_RGB = getattr(cv2, 'IMREAD_COLOR_RGB', None)
+
+# On CPU, images whose longest side exceeds this are downscaled before SAM
+CPU_PRESIZE_THRESHOLD = 2048
+
+# Bounds for the in-memory cache; each mask is a full-resolution uint8 array
+MAX_CACHED_IMAGES = 32
+MAX_CACHED_MASKS_PER_IMAGE = 64
+# Bound for the on-disk embedding cache; each ViT-H embedding is ~2-4 MB
+MAX_EMBEDDING_CACHE_FILES = 256
+
+def load_image_rgb(image_path):
+    """Load an image from disk as an RGB uint8 array for SAM"""
+    if str(image_path).lower().endswith(JPEG_EXTENSIONS):
+        # Let libjpeg decode at a reduced DCT scale (1/2, 1/4, 1/8) that still
+        # covers SAM's input size, instead of fully decoding large photos
+        with Image.open(image_path) as img:
+            img.draft('RGB', (SAM_INPUT_SIZE, SAM_INPUT_SIZE))
+            # Match cv2.imread/browser behaviour, which honour EXIF orientation
+            return np.asarray(ImageOps.exif_transpose(img).convert('RGB'))
+    
+    if IMREAD_COLOR_RGB is not None:
+        image = cv2.imread(image_path, IMREAD_COLOR_RGB)
+    else:
+        image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not load image from {image_path}")
+    if IMREAD_COLOR_RGB is not None:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+@lru_cache(maxsize=1024)
+def file_digest(path, mtime_ns, size):
+    """Content hash of a file; mtime and size are part of the key so edits miss"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def downscale_for_sam(image):
+    """Lanczos-resize an RGB array so its longest side matches SAM's input size"""
+    height, width = image.shape[:2]
+    scale = SAM_INPUT_SIZE / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    # reducing_gap lets Pillow box-reduce by an integer factor before the Lanczos pass
+    return np.asarray(Image.fromarray(image).resize(size, Image.LANCZOS, reducing_gap=3.0))
+
 class SAMSegmenter:
     def __init__(self):        # Enhanced GPU detection and setup
         if torch.cuda.is_available():
             self.device = torch.device('cuda')
+            self._use_cuda = True
             logger.info(f"CUDA available! Using GPU: {torch.cuda.get_device_name(0)}")
             logger.info(f"CUDA memory: {torch.cuda.get_device_properties(0).total_memory / 1024**3:.1f} GB")
             # Set optimal GPU settings for SAM real-time performance
             torch.backends.cudnn.benchmark = True
             torch.backends.cuda.matmul.allow_tf32 = True
+            torch.set_float32_matmul_precision('high')
             torch.backends.cudnn.deterministic = False  # For better performance
             # Enable memory optimization
             torch.cuda.empty_cache()
         else:
             self.device = torch.device('cpu')
+            self._use_cuda = False
             logger.warning("CUDA not available, using CPU (will be slower)")
             # CPU optimizations
             torch.set_num_threads(4)  # Limit CPU threads for better responsiveness
@@ -35,7 +95,9 @@ class SAMSegmenter:
         base_path = Path("/app") if in_docker else Path(".")
         
         self.sam_checkpoint = str(base_path / "models/sam_vit_h_4b8939.pth")
-        self.model_type = "vit_h"        
+        self.model_type = "vit_h"
+        # Image embeddings persisted across restarts, keyed by image content
+        self.embedding_cache_dir = base_path / "cache" / "embeddings"
         if not Path(self.sam_checkpoint).exists():
             raise FileNotFoundError(f"SAM checkpoint not found at {self.sam_checkpoint}. Please download it from https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth")
         
@@ -44,15 +106,18 @@ class SAMSegmenter:
         
         # Move to device and optimize for inference
         self.sam.to(device=self.device)
-        # Note: Removed half-precision to avoid dtype mismatch issues        # if self.device.type == 'cuda':
-        #     self.sam = self.sam.half()
-        #     logger.info("Using half-precision (FP16) for faster GPU inference")
+        self.sam.eval()
+        # Weights stay FP32; on CUDA, forward passes run under FP16 autocast (see
+        # _inference), which casts per-op and avoids the dtype mismatches .half() caused
+        if self._use_cuda:
+            logger.info("Using FP16 autocast for faster GPU inference")
+            self._compile_image_encoder()
         
         self.predictor = SamPredictor(self.sam)
         logger.info("SAM model loaded successfully")
         
-        # Cache for storing image embeddings and masks
-        self.cache: Dict[str, Dict] = {}
+        # LRU cache of image sizes and generated masks, most recently used last
+        self.cache: Dict[str, Dict] = OrderedDict()
         self.current_image_path = None        # Add thread lock to prevent concurrent access issues
         self._lock = threading.Lock()
         logger.info("Thread synchronization enabled for multi-image processing")
@@ -60,19 +125,15 @@ class SAMSegmenter:
     def set_image(self, image_path):
         """Set the image for segmentation and cache its embedding with thread safety"""
         with self._lock:
-            # Always load the image from disk to ensure we have the correct data
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError(f"Could not load image from {image_path}")
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)            # Check if we have cached embeddings for this image
+            # Check if we have cached embeddings for this image
             if image_path in self.cache:
                 logger.debug(f"Found cached embeddings for {Path(image_path).name}")
+                self.cache.move_to_end(image_path)
                 
                 # Only re-set the image if it's different from the current one
                 if self.current_image_path != image_path:
                     logger.debug(f"Re-setting predictor to cached image: {Path(image_path).name}")
-                    with torch.no_grad():
-                        self.predictor.set_image(image)
+                    self._embed_image(image_path)
                     self.current_image_path = image_path
                     self._last_set_image = image_path
                 else:
@@ -81,23 +142,134 @@ class SAMSegmenter:
                 return self.cache[image_path]['image_size']
             
             logger.info(f"Loading and processing new image: {Path(image_path).name}")
-            logger.debug(f"Image size: {image.shape[1]}x{image.shape[0]} pixels")
-              # Generate embeddings on GPU (this is the heavy computation)
-            with torch.no_grad():  # Disable gradients for faster inference
-                self.predictor.set_image(image)
-            
-            logger.debug(f"Image embeddings generated on {self.device}")
+            # Generate embeddings on GPU (this is the heavy computation)
+            image_size = self._embed_image(image_path)
+            logger.debug(f"Image size: {image_size[1]}x{image_size[0]} pixels")
             
             # Store in cache
-            self.cache[image_path] = {
-                'image_size': image.shape[:2],  # (height, width)
-                'masks': {},  # Will store generated masks
-                'embeddings': None  # This is implicitly stored in the predictor
-            }
+            self._add_to_cache(image_path, image_size)
             self.current_image_path = image_path
             self._last_set_image = image_path
             
-            return image.shape[:2]  # Return height, width
+            return image_size  # Return height, width
+
+    def _compile_image_encoder(self):
+        """Compile the ViT image encoder with Inductor; its input is always 1024x1024"""
+        if not hasattr(torch, 'compile'):  # torch < 2.0
+            return
+        
+        encoder = self.sam.image_encoder
+        try:
+            self.sam.image_encoder = torch.compile(encoder, mode='reduce-overhead', fullgraph=True)
+            # Compilation is lazy; trigger it (and CUDA graph capture) now rather
+            # than on the first user's request
+            logger.info("Compiling SAM image encoder (one-time warm-up)...")
+            dummy = torch.zeros(1, 3, SAM_INPUT_SIZE, SAM_INPUT_SIZE, device=self.device)
+            with self._inference():
+                self.sam.image_encoder(dummy)
+            logger.info("SAM image encoder compiled")
+        except Exception as e:
+            logger.warning(f"torch.compile failed, using eager image encoder: {e}")
+            self.sam.image_encoder = encoder
+
+    def _inference(self):
+        """Context for SAM forward passes: no autograd, plus FP16 autocast on CUDA"""
+        stack = ExitStack()
+        stack.enter_context(torch.inference_mode())
+        if self._use_cuda:
+            stack.enter_context(torch.autocast(device_type='cuda', dtype=torch.float16))
+        return stack
+
+    def _embed_image(self, image_path):
+        """Set the predictor's embedding for an image, from disk if already computed.
+        
+        Returns the image size as (height, width).
+        """
+        cache_path = self._embedding_cache_path(image_path)
+        if cache_path is not None and cache_path.exists():
+            try:
+                # The cache directory is shared; never unpickle arbitrary objects from it
+                state = torch.load(cache_path, map_location=self.device, weights_only=True)
+                features = state['features']
+                if not self._use_cuda:
+                    # Embeddings computed under CUDA autocast are FP16
+                    features = features.float()
+                # Mirror the state SamPredictor.set_torch_image() leaves behind
+                self.predictor.features = features
+                self.predictor.original_size = tuple(state['original_size'])
+                self.predictor.input_size = tuple(state['input_size'])
+                self.predictor.is_image_set = True
+                # Refresh the mtime so pruning evicts least recently used files
+                os.utime(cache_path)
+                logger.debug(f"Loaded cached embedding for {Path(image_path).name} from disk")
+                return self.predictor.original_size
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable embedding cache {cache_path.name}: {e}")
+        
+        image = load_image_rgb(image_path)
+        if not self._use_cuda and max(image.shape[:2]) > CPU_PRESIZE_THRESHOLD:
+            # SamPredictor resizes to 1024px anyway; doing it here with Pillow is much
+            # cheaper on CPU and keeps masks (and the mask cache) at working size.
+            # Callers only see normalized coordinates, so the returned size is the
+            # frame that point prompts and polygons are expressed in.
+            image = downscale_for_sam(image)
+        with self._inference():
+            self.predictor.set_image(image)
+        logger.debug(f"Image embeddings generated on {self.device}")
+        
+        if cache_path is not None:
+            try:
+                self.embedding_cache_dir.mkdir(parents=True, exist_ok=True)
+                # Write to a temporary name so readers never see a partial file
+                tmp_path = cache_path.with_suffix('.tmp')
+                torch.save({
+                    'features': self.predictor.features.cpu(),
+                    'original_size': self.predictor.original_size,
+                    'input_size': self.predictor.input_size,
+                }, tmp_path)
+                os.replace(tmp_path, cache_path)
+                self._prune_embedding_cache()
+            except Exception as e:
+                logger.warning(f"Could not persist embedding for {Path(image_path).name}: {e}")
+        
+        return image.shape[:2]
+
+    def _add_to_cache(self, image_path, image_size):
+        """Add an image entry, evicting the least recently used ones beyond the limit"""
+        self.cache[image_path] = {
+            'image_size': image_size,  # (height, width)
+            'masks': OrderedDict(),  # Will store generated masks
+            'embeddings': None  # This is implicitly stored in the predictor
+        }
+        while len(self.cache) > MAX_CACHED_IMAGES:
+            evicted_path, _ = self.cache.popitem(last=False)
+            logger.debug(f"Evicted {Path(evicted_path).name} from segmentation cache")
+
+    def _prune_embedding_cache(self):
+        """Delete the least recently used embeddings beyond MAX_EMBEDDING_CACHE_FILES"""
+        entries = []
+        for path in self.embedding_cache_dir.glob('*.pt'):
+            try:
+                entries.append((path.stat().st_mtime_ns, path))
+            except OSError:
+                continue  # Removed by another process in the meantime
+        
+        excess = len(entries) - MAX_EMBEDDING_CACHE_FILES
+        for _, path in sorted(entries)[:max(excess, 0)]:
+            try:
+                path.unlink()
+                logger.debug(f"Pruned cached embedding {path.name}")
+            except OSError:
+                pass
+
+    def _embedding_cache_path(self, image_path):
+        """On-disk embedding location for an image's contents, or None if unreadable"""
+        try:
+            stat = os.stat(image_path)
+            digest = file_digest(str(image_path), stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+        return self.embedding_cache_dir / f"{self.model_type}_{digest}.pt"
 
     def preprocess_image(self, image_path):
         """Pre-generate embeddings for an image without requiring immediate segmentation"""
@@ -110,21 +282,10 @@ class SAMSegmenter:
             try:
                 logger.info(f"Pre-processing image for faster segmentation: {Path(image_path).name}")
                 
-                # Load and process the image
-                image = cv2.imread(image_path)
-                if image is None:
-                    raise ValueError(f"Could not load image from {image_path}")
-                    
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                
                 # Generate embeddings on GPU using the main predictor
-                with torch.no_grad():
-                    self.predictor.set_image(image)                # Store in cache and set as current image
-                self.cache[image_path] = {
-                    'image_size': image.shape[:2],  # (height, width)
-                    'masks': {},  # Will store generated masks
-                    'embeddings': None  # This is implicitly stored in the predictor
-                }
+                image_size = self._embed_image(image_path)
+                # Store in cache and set as current image
+                self._add_to_cache(image_path, image_size)
                 self.current_image_path = image_path
                 self._last_set_image = image_path                
                 logger.info(f"Pre-processing complete for {Path(image_path).name}")
@@ -144,24 +305,8 @@ class SAMSegmenter:
             return self.cache[self.current_image_path]['masks'][point_key]
         
         with self._lock:
-            if self.current_image_path is None:
-                raise ValueError("No image set for segmentation. Call set_image() first.")
-            
-            # Ensure we have the correct image set in the predictor
-            if self.current_image_path not in self.cache:
-                raise ValueError(f"Image {self.current_image_path} not found in cache. Call set_image() first.")
-            
-            # Re-set the image if it's not the current one (safety check)
-            # This ensures the predictor has the correct embeddings
-            if hasattr(self, '_last_set_image') and self._last_set_image != self.current_image_path:
-                logger.debug(f"Re-setting image in predictor for thread safety: {Path(self.current_image_path).name}")
-                image = cv2.imread(self.current_image_path)
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                with torch.no_grad():
-                    self.predictor.set_image(image)
-            
-            self._last_set_image = self.current_image_path
-              # Double-check cache (in case another thread added it)
+            self._ensure_predictor_image()
+            # Double-check cache (in case another thread added it)
             if point_key in self.cache[self.current_image_path]['masks']:
                 logger.debug(f"Using cached mask for point {point_coords} (added by another thread)")
                 return self.cache[self.current_image_path]['masks'][point_key]
@@ -179,7 +324,7 @@ class SAMSegmenter:
                 point_labels = point_labels.astype(np.int32)
                 
                 # Use GPU optimization if available
-                with torch.no_grad():  # Disable gradient computation for faster inference
+                with self._inference():
                     masks, scores, _ = self.predictor.predict(
                         point_coords=point_coords_array,
                         point_labels=point_labels,
@@ -187,12 +332,14 @@ class SAMSegmenter:
                     )
                 
                 best_mask_idx = np.argmax(scores)
-                mask = masks[best_mask_idx].astype(np.uint8) * 255  # Convert to 8-bit mask
+                # 0/1 uint8 mask; findContours treats any nonzero pixel as foreground,
+                # so scaling to 255 would just be another full-image pass
+                mask = masks[best_mask_idx].astype(np.uint8)
                 
                 logger.debug(f"Mask generated successfully (confidence: {scores[best_mask_idx]:.3f})")
                 
                 # Cache the result
-                self.cache[self.current_image_path]['masks'][point_key] = mask
+                self._cache_mask(point_key, mask)
                 
                 return mask
                 
@@ -203,33 +350,98 @@ class SAMSegmenter:
                     torch.cuda.empty_cache()
                 raise
 
+    def predict_from_points_batch(self, points_list):
+        """Generate one mask per foreground point prompt in a single batched forward pass"""
+        point_keys = [tuple(point) for point in points_list]
+        
+        with self._lock:
+            self._ensure_predictor_image()
+            masks_cache = self.cache[self.current_image_path]['masks']
+            results = {key: masks_cache[key] for key in point_keys if key in masks_cache}
+            # Deduplicate while keeping order so each prompt is decoded once
+            missing = [key for key in dict.fromkeys(point_keys) if key not in results]
+            
+            if missing:
+                logger.debug(f"Generating {len(missing)} masks in one batch on {self.device}")
+                try:
+                    # SAM expects (B, N, 2) coordinates in the resized input frame
+                    coords = torch.as_tensor(np.array(missing, dtype=np.float32), device=self.device)
+                    coords = self.predictor.transform.apply_coords_torch(coords, self.predictor.original_size)
+                    coords = coords.unsqueeze(1)
+                    labels = torch.ones((len(missing), 1), dtype=torch.int, device=self.device)
+                    
+                    with self._inference():
+                        masks, scores, _ = self.predictor.predict_torch(
+                            point_coords=coords,
+                            point_labels=labels,
+                            multimask_output=True
+                        )
+                    
+                    # Pick the best-scored of the multimask outputs for each prompt
+                    best = scores.argmax(dim=1)
+                    best_masks = masks[torch.arange(len(missing), device=self.device), best]
+                    best_masks = best_masks.cpu().numpy().view(np.uint8)  # bool -> 0/1 uint8, no copy
+                except Exception as e:
+                    logger.error(f"Error generating batched masks: {e}")
+                    if torch.cuda.is_available():
+                        torch.cuda.empty_cache()
+                    raise
+                
+                for key, mask in zip(missing, best_masks):
+                    results[key] = mask
+                    self._cache_mask(key, mask)
+            
+            return [results[key] for key in point_keys]
+
+    def _ensure_predictor_image(self):
+        """Make sure the predictor holds the embedding for the current image (call with lock held)"""
+        if self.current_image_path is None:
+            raise ValueError("No image set for segmentation. Call set_image() first.")
+        
+        # Ensure we have the correct image set in the predictor
+        if self.current_image_path not in self.cache:
+            raise ValueError(f"Image {self.current_image_path} not found in cache. Call set_image() first.")
+        
+        # Re-set the image if it's not the current one (safety check)
+        # This ensures the predictor has the correct embeddings
+        if hasattr(self, '_last_set_image') and self._last_set_image != self.current_image_path:
+            logger.debug(f"Re-setting image in predictor for thread safety: {Path(self.current_image_path).name}")
+            self._embed_image(self.current_image_path)
+        
+        self._last_set_image = self.current_image_path
+
+    def _cache_mask(self, point_key, mask):
+        """Cache a mask for the current image, dropping the oldest beyond the limit"""
+        masks_cache = self.cache[self.current_image_path]['masks']
+        masks_cache[point_key] = mask
+        while len(masks_cache) > MAX_CACHED_MASKS_PER_IMAGE:
+            masks_cache.popitem(last=False)
+
     def mask_to_polygon(self, mask):
         """Convert binary mask to polygon coordinates (normalized 0-1)"""
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # TC89_KCOS drops near-collinear vertices while tracing, so SAM's jagged
+        # mask edges come back with far fewer points than CHAIN_APPROX_SIMPLE
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_TC89_KCOS)
         if not contours:
             return None
         
-        largest_contour = max(contours, key=cv2.contourArea)
-        polygon = largest_contour.squeeze().tolist()
-        
-        if not isinstance(polygon[0], list):
-            polygon = [polygon]
+        if len(contours) == 1:
+            largest_contour = contours[0]
+        else:
+            areas = np.fromiter((cv2.contourArea(c) for c in contours), dtype=np.float64, count=len(contours))
+            largest_contour = contours[int(areas.argmax())]
+        # (N, 1, 2) -> (N, 2); also handles single-point contours
+        points = largest_contour.reshape(-1, 2)
         
         # Get image dimensions for normalization
         if self.current_image_path and self.current_image_path in self.cache:
             height, width = self.cache[self.current_image_path]['image_size']
             
-            # Normalize coordinates to 0-1 range
-            normalized_polygon = []
-            for point in polygon:
-                if len(point) == 2:  # [x, y]
-                    normalized_x = point[0] / width
-                    normalized_y = point[1] / height
-                    normalized_polygon.append([normalized_x, normalized_y])
-            
-            return normalized_polygon
+            # Normalize coordinates to 0-1 range in one vectorized pass and
+            # only build Python lists once, for JSON serialization
+            return (points / np.array([width, height], dtype=np.float64)).tolist()
             
-        return polygon
+        return points.tolist()
 
     def clear_cache(self, image_path=None):
         """Clear the cache for a specific image or all images"""
@@ -239,5 +451,5 @@ class SAMSegmenter:
                 if self.current_image_path == image_path:
                     self.current_image_path = None
         else:
-            self.cache = {}
+            self.cache = OrderedDict()
             self.current_image_path = None